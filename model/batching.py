@@ -0,0 +1,28 @@
+class TokenBudget(object):
+    """
+    batch_size_fn for torchtext iterators. With it batch_size is the maximum number of
+    padded tokens in a batch instead of the number of tweets, so batches of short
+    tweets hold more examples than batches of long ones.
+    """
+
+    def __init__(self, n_special_tokens=2):
+        self.n_special_tokens = n_special_tokens  # <sos> and <eos>
+        self.max_len = 0
+
+    def __call__(self, new, count, sofar):
+        if count == 1:
+            self.max_len = 0
+        self.max_len = max(self.max_len, len(new.SentimentText) + self.n_special_tokens)
+        return count * self.max_len
+
+
+class Truncate(object):
+    """
+    Field preprocessing that caps the number of tokens of a tweet
+    """
+
+    def __init__(self, max_len):
+        self.max_len = max_len
+
+    def __call__(self, tokens):
+        return tokens[:self.max_len]
@@ -0,0 +1,182 @@
+import os
+import resource
+import tempfile
+import time
+from collections import Counter
+from multiprocessing import get_context
+
+import torch
+import torch.nn as nn
+from torchtext.vocab import Vocab
+
+from bulk_score import load_model
+from gru import RNNModel, BagModel, PQEmbedding
+from quantization import train_pq, decode_pq, compression_ratio
+from torchtext_sentiment import get_optimizer, train_epoch
+
+
+def random_batches(n_batches, batch_size, vocab_size, max_len=40, seed=10):
+    """
+    Synthetic padded batches shaped like the tweet batches of BucketIterator
+    :param n_batches:
+    :param batch_size:
+    :param vocab_size:
+    :param max_len:
+    :param seed:
+    :return:
+    """
+    generator = torch.Generator().manual_seed(seed)
+    batches = []
+    for _ in range(n_batches):
+        text = torch.randint(2, vocab_size, (batch_size, max_len), generator=generator)
+        y = torch.randint(0, 2, (batch_size,), generator=generator).float()
+        batches.append((text, y))
+    return batches
+
+
+def optimizer_state_mb(optimizer):
+    optimizers = getattr(optimizer, 'optimizers', [optimizer])
+    n_bytes = 0
+    for opt in optimizers:
+        for state in opt.state.values():
+            for value in state.values():
+                if torch.is_tensor(value):
+                    n_bytes += value.numel() * value.element_size()
+    return n_bytes / 1024 ** 2
+
+
+def grad_mb(model):
+    n_bytes = 0
+    for p in model.parameters():
+        if p.grad is None:
+            continue
+        grad = p.grad.coalesce()._values() if p.grad.is_sparse else p.grad
+        n_bytes += grad.numel() * grad.element_size()
+    return n_bytes / 1024 ** 2
+
+
+def benchmark_sparse_embeddings(vocab_size=500000, embedding_dim=300, hidden_dim=256,
+                                batch_size=128, n_batches=20):
+    """
+    Step time and gradient/optimizer memory of the dense and the sparse embedding path
+    :return:
+    """
+    batches = random_batches(n_batches, batch_size, vocab_size)
+    criterion = nn.BCEWithLogitsLoss()
+    for sparse in [False, True]:
+        torch.manual_seed(10)
+        model = RNNModel(vocab_size=vocab_size, embedding_dim=embedding_dim, hidden_dim=hidden_dim,
+                         output_dim=1, n_layers=1, bidirectional=True, dropout=0.4, pad_idx=1,
+                         use_gru=False, sparse=sparse)
+        optimizer = get_optimizer(model, lr=1e-3)
+        model.train()
+        start_time = time.time()
+        for text, y in batches:
+            optimizer.zero_grad()
+            predictions = model(text, [text.shape[1]] * text.shape[0]).squeeze(1)
+            loss = criterion(predictions, y)
+            loss.backward()
+            optimizer.step()
+        step_ms = 1000 * (time.time() - start_time) / n_batches
+        print(f"{'sparse' if sparse else 'dense'}: {step_ms:.1f} ms/step | "
+              f"grads {grad_mb(model):.1f} MB | optimizer state {optimizer_state_mb(optimizer):.1f} MB")
+
+
+def benchmark_pq_embeddings(vocab_size=100000, embedding_dim=300, n_subspaces=50,
+                            batch_size=128, max_len=40, n_lookups=100):
+    """
+    Compression ratio, reconstruction error and lookup latency of PQEmbedding
+    against the float32 nn.Embedding. Test accuracy is compared by running
+    analyse_sentiments with PQ_SUBSPACES None and set.
+    :return:
+    """
+    torch.manual_seed(10)
+    weight = torch.randn(vocab_size, embedding_dim)
+    codebooks, codes = train_pq(weight.numpy(), n_subspaces=n_subspaces)
+    error = ((decode_pq(codebooks, codes) - weight.numpy()) ** 2).sum() / (weight.numpy() ** 2).sum()
+    print(f"compression ratio {compression_ratio(vocab_size, embedding_dim, n_subspaces):.1f}x | "
+          f"relative reconstruction error {error:.3f}")
+
+    text = torch.randint(2, vocab_size, (batch_size, max_len))
+    for name, embedding in [('float32', nn.Embedding.from_pretrained(weight, padding_idx=1)),
+                            ('pq', PQEmbedding(codebooks, codes, padding_idx=1))]:
+        with torch.no_grad():
+            embedding(text)
+            start_time = time.time()
+            for _ in range(n_lookups):
+                embedding(text)
+        print(f"{name}: {1000 * (time.time() - start_time) / n_lookups:.2f} ms per {batch_size}x{max_len} lookup")
+
+
+def check_pq_checkpoint(vocab_size=1000, embedding_dim=20, n_subspaces=5, batch_size=16, max_len=30):
+    """
+    Saves product-quantized RNN and bag checkpoints the way analyse_sentiments does and
+    checks that bulk_score.load_model rebuilds models with the same predictions.
+    :return:
+    """
+    vocab = Vocab(Counter({f"word{i}": vocab_size - i for i in range(vocab_size - 4)}),
+                  specials=['<unk>', '<pad>', '<sos>', '<eos>'])
+    pad_idx = vocab.stoi['<pad>']
+    params = {'RNN_HIDDEN_DIM': 16, 'BAG_HIDDEN_DIM': 16, 'RNN_N_LAYERS': 1, 'RNN_DROPOUT': 0.4, 'RNN_USE_GRU': True}
+    text = torch.randint(2, len(vocab), (batch_size, max_len))
+    for model_type in ['rnn', 'bag']:
+        torch.manual_seed(10)
+        if model_type == 'bag':
+            model = BagModel(vocab_size=len(vocab), embedding_dim=embedding_dim, hidden_dim=16, output_dim=1,
+                             dropout=0.4, pad_idx=pad_idx)
+        else:
+            model = RNNModel(vocab_size=len(vocab), embedding_dim=embedding_dim, hidden_dim=16, output_dim=1,
+                             n_layers=1, bidirectional=True, dropout=0.4, pad_idx=pad_idx, use_gru=True)
+        codebooks, codes = train_pq(model.embedding.weight.data.numpy(), n_subspaces=n_subspaces)
+        model.embedding = PQEmbedding(codebooks, codes, padding_idx=pad_idx)
+        model.eval()
+        with tempfile.TemporaryDirectory() as directory:
+            model_name = os.path.join(directory, 'pq')
+            torch.save(model.state_dict(), f"{model_name}.pt")
+            torch.save(vocab, f"{model_name}_vocab.pt")
+            loaded, _ = load_model(dict(params, MODEL_TYPE=model_type), model_name)
+        with torch.no_grad():
+            expected = model(text, [max_len] * batch_size)
+            predictions = loaded(text, [max_len] * batch_size)
+        if not torch.allclose(expected, predictions):
+            raise AssertionError(f"{model_type} predictions differ after loading the PQ checkpoint")
+        print(f"{model_type}: PQ checkpoint loads with {len(codes)} rows and identical predictions")
+
+
+def _accumulation_run(args):
+    micro_batch_size, effective_batch_size, vocab_size, embedding_dim, max_len, n_steps = args
+    accumulation_steps = effective_batch_size // micro_batch_size
+    batches = random_batches(n_steps * accumulation_steps, micro_batch_size, vocab_size, max_len=max_len)
+    torch.manual_seed(10)
+    model = RNNModel(vocab_size=vocab_size, embedding_dim=embedding_dim, hidden_dim=256,
+                     output_dim=1, n_layers=1, bidirectional=True, dropout=0.4, pad_idx=1, use_gru=False)
+    optimizer = get_optimizer(model, lr=1e-3)
+    start_time = time.time()
+    train_epoch(model, batches, optimizer, nn.BCEWithLogitsLoss(), torch.device('cpu'),
+                accumulation_steps=accumulation_steps)
+    tweets_per_sec = n_steps * effective_batch_size / (time.time() - start_time)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return tweets_per_sec, peak_mb
+
+
+def benchmark_accumulation(micro_batch_sizes=(1024, 256, 128, 64), effective_batch_size=1024,
+                           vocab_size=100000, embedding_dim=300, max_len=60, n_steps=5):
+    """
+    Peak memory and throughput of one effective batch reached with different micro-batch sizes.
+    Every configuration runs in a fresh process so that the peak RSS is its own.
+    :return:
+    """
+    context = get_context('spawn')
+    for micro_batch_size in micro_batch_sizes:
+        with context.Pool(1) as pool:
+            tweets_per_sec, peak_mb = pool.apply(_accumulation_run, ((micro_batch_size, effective_batch_size,
+                                                                     vocab_size, embedding_dim, max_len, n_steps),))
+        print(f"micro-batch {micro_batch_size} x {effective_batch_size // micro_batch_size} steps: "
+              f"{tweets_per_sec:.0f} tweets/s | peak RSS {peak_mb:.0f} MB")
+
+
+if __name__ == '__main__':
+    check_pq_checkpoint()
+    benchmark_sparse_embeddings()
+    benchmark_pq_embeddings()
+    benchmark_accumulation()
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import time
+from collections import deque
+from multiprocessing import Pool
+
+import pandas as pd
+import torch
+
+from gru import PQEmbedding, build_model
+from preprocessing import preprocess
+from results_store import ResultsStore, RESULTS_PATH
+
+# per worker process state, set by _init_worker
+_worker = {}
+
+
+def load_model(params, model_name, device=torch.device('cpu')):
+    """
+    Rebuilds a model saved by analyse_sentiments from its params, checkpoint and vocab
+    :param params: params of the run, e.g. from ResultsStore.latest(model_name)
+    :param model_name:
+    :param device:
+    :return: model in eval mode and its vocab
+    """
+    vocab = torch.load(f"{model_name}_vocab.pt")
+    state_dict = torch.load(f"{model_name}.pt", map_location=device)
+    pad_idx = vocab.stoi['<pad>']
+    quantized = 'embedding.codes' in state_dict
+    if quantized:
+        embedding_dim = state_dict['embedding.codebooks'].shape[0] * state_dict['embedding.codebooks'].shape[2]
+    else:
+        embedding_dim = state_dict['embedding.weight'].shape[1]
+
+    # a quantized table is swapped in below, do not allocate the float32 one,
+    # the placeholder only needs to hold the padding row
+    table_size = pad_idx + 1 if quantized else len(vocab)
+    model = build_model(dict(params, HASH_BUCKETS=0) if quantized else params, table_size, embedding_dim, pad_idx)
+    if quantized:
+        model.embedding = PQEmbedding(state_dict['embedding.codebooks'], state_dict['embedding.codes'],
+                                      padding_idx=pad_idx)
+    model.load_state_dict(state_dict)
+    model.to(device)
+    model.eval()
+    return model, vocab
+
+
+def numericalize(text, vocab, max_len=None):
+    """
+    Cleans a tweet like preprocess_text and adds <sos>/<eos> like the torchtext field
+    :param text:
+    :param vocab:
+    :param max_len:
+    :return: list of token indices
+    """
+    tokens = preprocess(text, set()).split()
+    if max_len:
+        tokens = tokens[:max_len]
+    return [vocab.stoi['<sos>']] + [vocab.stoi[t] for t in tokens] + [vocab.stoi['<eos>']]
+
+
+def _init_worker(params, model_name):
+    # one thread per process, parallelism comes from the processes
+    torch.set_num_threads(1)
+    _worker['model'], _worker['vocab'] = load_model(params, model_name)
+    _worker['max_len'] = params.get('RNN_MAX_LEN', None)
+
+
+def _score_chunk(args):
+    texts, batch_size = args
+    model, vocab = _worker['model'], _worker['vocab']
+    sequences = [numericalize(text, vocab, _worker['max_len']) for text in texts]
+    # batches only hold tweets of the same length, without padding a score
+    # does not depend on the other tweets of the batch or on the chunking
+    by_length = {}
+    for i, sequence in enumerate(sequences):
+        by_length.setdefault(len(sequence), []).append(i)
+    scores = [0.0] * len(texts)
+    with torch.no_grad():
+        for length, indices in by_length.items():
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start:start + batch_size]
+                text = torch.LongTensor([sequences[i] for i in batch])
+                predictions = torch.sigmoid(model(text, [length] * len(batch)).view(-1))
+                for i, prediction in zip(batch, predictions.tolist()):
+                    scores[i] = prediction
+    return scores
+
+
+def read_chunks(path, chunksize, text_column):
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        return pd.read_json(path, lines=True, chunksize=chunksize)
+    return pd.read_csv(path, chunksize=chunksize, dtype={text_column: str})
+
+
+def bulk_score(input_path, output_path, params, model_name, n_workers=os.cpu_count(),
+               chunksize=10000, batch_size=256, text_column='text'):
+    """
+    Streams input_path in chunks, scores the chunks in n_workers processes that each hold
+    one loaded model and appends the rows with a 'sentiment' column to output_path in input order.
+    :param input_path: .csv or .jsonl with a text column
+    :param output_path: .csv or .jsonl
+    :param params: params of the trained model
+    :param model_name:
+    :param n_workers:
+    :param chunksize: rows per chunk sent to a worker
+    :param batch_size: tweets per forward pass
+    :param text_column:
+    :return: number of scored rows
+    """
+    jsonl = output_path.endswith('.jsonl') or output_path.endswith('.json')
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    def write(df, scores):
+        df['sentiment'] = scores
+        if jsonl:
+            # older pandas do not end lines=True output with a newline, chunks would run together
+            with open(output_path, 'a', encoding='utf-8') as f:
+                f.write(df.to_json(orient='records', lines=True).rstrip('\n') + '\n')
+        else:
+            df.to_csv(output_path, mode='a', header=not os.path.exists(output_path), index=False)
+        return len(df)
+
+    # a broken checkpoint fails here, a failing pool initializer would be retried forever
+    load_model(params, model_name)
+
+    n_rows = 0
+    start_time = time.time()
+    pending = deque()
+    with Pool(n_workers, initializer=_init_worker, initargs=(params, model_name)) as pool:
+        for df in read_chunks(input_path, chunksize, text_column):
+            texts = df[text_column].fillna('').tolist()
+            pending.append((df, pool.apply_async(_score_chunk, ((texts, batch_size),))))
+            # at most two chunks per worker in flight keeps memory bounded, results are written in input order
+            while len(pending) >= 2 * n_workers:
+                df, result = pending.popleft()
+                n_rows += write(df, result.get())
+                print(f"Scored {n_rows} rows | {n_rows / (time.time() - start_time):.0f} rows/s")
+        while pending:
+            df, result = pending.popleft()
+            n_rows += write(df, result.get())
+    print(f"Scored {n_rows} rows with {n_workers} workers in {time.time() - start_time:.1f} s")
+    return n_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score the sentiment of a large tweet file")
+    parser.add_argument('input_path')
+    parser.add_argument('output_path')
+    parser.add_argument('model_name', help="name used by analyse_sentiments, e.g. <vectors>_LSTM_10_epochs_1")
+    parser.add_argument('--params', default=None,
+                        help="json file with the model params, defaults to the run in the results store")
+    parser.add_argument('--results', default=RESULTS_PATH)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunksize', type=int, default=10000)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--text_column', default='text')
+    args = parser.parse_args()
+
+    if args.params is not None:
+        with open(args.params) as f:
+            params = json.load(f)
+    else:
+        run = ResultsStore(args.results).latest(args.model_name, kind='classifier')
+        if run is None:
+            raise ValueError(f"No run named {args.model_name} in {args.results}, pass --params")
+        params = run['params']
+    bulk_score(args.input_path, args.output_path, params, args.model_name, n_workers=args.workers,
+               chunksize=args.chunksize, batch_size=args.batch_size, text_column=args.text_column)
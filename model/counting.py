@@ -0,0 +1,95 @@
+from collections import Counter
+from multiprocessing import Pool
+
+import pandas as pd
+
+
+class MisraGries(object):
+    """
+    Heavy hitters summary holding at most 2k counters. Every count is underestimated
+    by at most self.error <= n / (k + 1) where n is the number of counted tokens,
+    so every word more frequent than that is guaranteed to be kept.
+    Summaries of different corpus parts can be merged with the same guarantee.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.counts = {}
+        self.n = 0
+        self.n_docs = 0
+        self.error = 0
+
+    def update(self, tokens):
+        counts = self.counts
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        self.n += len(tokens)
+        self.n_docs += 1
+        if len(counts) > 2 * self.k:
+            self._prune()
+
+    def _prune(self):
+        # subtract the (k + 1)-th largest count from all counters and drop the non-positive ones
+        if len(self.counts) <= self.k:
+            return
+        threshold = sorted(self.counts.values(), reverse=True)[self.k]
+        self.counts = {token: count - threshold for token, count in self.counts.items() if count > threshold}
+        self.error += threshold
+
+    def merge(self, other):
+        for token, count in other.counts.items():
+            self.counts[token] = self.counts.get(token, 0) + count
+        self.n += other.n
+        self.n_docs += other.n_docs
+        self.error += other.error
+        self._prune()
+        return self
+
+    def most_common(self, n=None):
+        return Counter(self.counts).most_common(n)
+
+    def counter(self, min_freq=1):
+        """
+        Counter of the kept words, e.g. for torchtext Vocab or gensim build_vocab_from_freq
+        :param min_freq:
+        :return:
+        """
+        return Counter({token: count for token, count in self.counts.items() if count >= min_freq})
+
+
+def lower_split(text):
+    return text.lower().split()
+
+
+def _count_chunk(args):
+    texts, k, tokenize = args
+    summary = MisraGries(k)
+    for text in texts:
+        summary.update(tokenize(str(text)))
+    summary._prune()
+    return summary
+
+
+def count_csv(path, k, tokenize=lower_split, n_workers=1, chunksize=100000):
+    """
+    Streams the text column of a csv in chunks and counts it in n_workers processes.
+    Memory is bounded by the chunk size and 2k counters per worker.
+    :param path:
+    :param k: number of counters, words with frequency above n / (k + 1) are always kept
+    :param tokenize: has to match the tokenization of the consumer
+    :param n_workers:
+    :param chunksize: rows per chunk
+    :return: merged MisraGries summary
+    """
+    chunks = ((df['text'].tolist(), k, tokenize) for df in pd.read_csv(path, usecols=['text'], chunksize=chunksize))
+    summary = MisraGries(k)
+    if n_workers > 1:
+        with Pool(n_workers) as pool:
+            for chunk_summary in pool.imap_unordered(_count_chunk, chunks):
+                summary.merge(chunk_summary)
+    else:
+        for chunk in chunks:
+            summary.merge(_count_chunk(chunk))
+    print(f"Counted {summary.n} tokens, kept {len(summary.counts)} words, "
+          f"counts underestimated by at most {summary.error}")
+    return summary
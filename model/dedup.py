@@ -0,0 +1,167 @@
+import hashlib
+import math
+import numpy as np
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def hash64(text):
+    """
+    Stable 64-bit hash of a string, used for exact duplicate detection
+    :param text:
+    :return:
+    """
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def hash32(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=4).digest(), 'little')
+
+
+def shingles(tokens, shingle_size=2):
+    """
+    Token n-grams of a tweet. Tweets shorter than shingle_size give a single shingle.
+    :param tokens:
+    :param shingle_size:
+    :return:
+    """
+    if len(tokens) <= shingle_size:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)}
+
+
+class BloomFilter(object):
+    """
+    Fixed-size set of 64-bit hashes. Membership tests have no false negatives and
+    about error_rate false positives as long as at most capacity hashes were added.
+    Needs -capacity * ln(error_rate) / ln(2)^2 bits, independent of how many items are seen.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.n_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * math.log(2))))
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+        self.offsets = np.arange(self.n_hashes, dtype=np.uint64)
+
+    def _positions(self, hashes):
+        # double hashing, h1 + i * h2 stays far below 2^64
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        h1 = hashes & np.uint64(MAX_HASH)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        return (h1[:, None] + self.offsets[None, :] * h2[:, None]) % np.uint64(self.n_bits)
+
+    def contains(self, hashes):
+        """
+        :param hashes: 64-bit hashes
+        :return: boolean array, True where a hash was probably added before
+        """
+        positions = self._positions(hashes)
+        bits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+    def add(self, hashes):
+        positions = self._positions(hashes).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    @property
+    def size_mb(self):
+        return self.bits.nbytes / 1024 ** 2
+
+
+class MinHashLSH(object):
+    """
+    MinHash signatures over token shingles bucketed with banded LSH.
+    The band hashes of all bands share one Bloom filter, so memory is fixed by capacity.
+    """
+
+    def __init__(self, num_perm=128, bands=16, shingle_size=2, seed=10, capacity=2000000, error_rate=1e-4):
+        assert num_perm % bands == 0, "num_perm has to be divisible by bands"
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # a and b below 2^32 so that a * h + b fits in uint64
+        self.a = rng.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+        # a tweet is tested against all of its bands, split the error rate between them
+        self.buckets = BloomFilter(capacity * bands, error_rate / bands)
+
+    def signature(self, tokens):
+        hashes = np.array([hash32(s) for s in shingles(tokens, self.shingle_size)], dtype=np.uint64)
+        permuted = (np.outer(hashes, self.a) + self.b) % np.uint64(MERSENNE_PRIME)
+        return (permuted & np.uint64(MAX_HASH)).min(axis=0)
+
+    def band_hashes(self, signature):
+        # the band number is hashed too, equal rows in different bands are not a match
+        return [hash64(f"{i}:" + signature[i * self.rows:(i + 1) * self.rows].tobytes().hex())
+                for i in range(self.bands)]
+
+    def insert_if_new(self, tokens):
+        """
+        Returns False if a tweet sharing a band with tokens has been seen before,
+        otherwise stores the bands of tokens and returns True.
+        :param tokens:
+        :return:
+        """
+        band_hashes = self.band_hashes(self.signature(tokens))
+        if self.buckets.contains(band_hashes).any():
+            return False
+        self.buckets.add(band_hashes)
+        return True
+
+
+def deduplicate(texts, near_duplicates=True, num_perm=128, bands=16, shingle_size=2,
+                capacity=2000000, error_rate=1e-4):
+    """
+    Streams over cleaned tweets and yields True for the first occurrence of each tweet,
+    False for exact duplicates and, optionally, near-duplicates found with MinHash/LSH.
+    Seen tweets are kept in Bloom filters sized for capacity tweets, about 5 MB for the
+    exact duplicates and 100 MB for the LSH bands with the defaults, whatever the corpus size.
+    About error_rate of the unique tweets are dropped as false positives, more once
+    the corpus grows beyond capacity.
+    :param texts: iterable of cleaned tweets
+    :param near_duplicates:
+    :param num_perm: number of MinHash permutations
+    :param bands: number of LSH bands, more bands catch less similar tweets
+    :param shingle_size: tokens per shingle
+    :param capacity: number of tweets the filters are sized for, e.g. 2e6 for Sentiment140
+    :param error_rate: false positive rate of the exact and of the near-duplicate test
+    :return:
+    """
+    seen = BloomFilter(capacity, error_rate)
+    lsh = None
+    if near_duplicates:
+        lsh = MinHashLSH(num_perm=num_perm, bands=bands, shingle_size=shingle_size,
+                         capacity=capacity, error_rate=error_rate)
+    for text in texts:
+        text = str(text)
+        h = [hash64(text)]
+        if seen.contains(h)[0]:
+            yield False
+            continue
+        seen.add(h)
+        if lsh is not None and not lsh.insert_if_new(text.split()):
+            yield False
+            continue
+        yield True
+
+
+def report_dedup(texts_before, texts_after):
+    """
+    Prints the corpus reduction. Word2vec training and train_epoch are linear in
+    the number of tokens and examples, so the ratios are the expected speedups.
+    :param texts_before:
+    :param texts_after:
+    :return:
+    """
+    rows_before, rows_after = len(texts_before), len(texts_after)
+    tokens_before = sum(len(str(t).split()) for t in texts_before)
+    tokens_after = sum(len(str(t).split()) for t in texts_after)
+    print(f"Dedup kept {rows_after}/{rows_before} tweets "
+          f"({100 * (1 - rows_after / max(rows_before, 1)):.1f}% removed), "
+          f"{tokens_after}/{tokens_before} tokens")
+    print(f"Expected speedup: create_embeddings x{tokens_before / max(tokens_after, 1):.2f}, "
+          f"train_epoch x{rows_before / max(rows_after, 1):.2f}")
@@ -2,10 +2,14 @@ from gensim.models import Word2Vec
 from gensim.test.utils import datapath
 from gensim import utils
 import os
+import time
 import pandas as pd
 
 from torchtext.vocab import Vectors
 
+from counting import count_csv
+from results_store import ResultsStore
+
 class MyCorpus(object):
     """An interator that yields sentences (lists of str)."""
 
@@ -17,8 +21,11 @@ class MyCorpus(object):
             print(utils.simple_preprocess(line))
             yield utils.simple_preprocess(line)
 
+    def __init__(self, path="data/processed_train.csv"):
+        self.path = path
+
     def __iter__(self):
-        df = pd.read_csv("data/processed_train.csv")
+        df = pd.read_csv(self.path)
         for i in range(len(df)):
             line = str(df['text'][i])
             preprocessed = utils.simple_preprocess(line)
@@ -27,11 +34,12 @@ class MyCorpus(object):
             yield preprocessed
 
 
-def create_embeddings(embedding_params, i):
+def create_embeddings(embedding_params, i, store=None):
     """
 
     :param embedding_params:
     :param i:
+    :param store: ResultsStore the run is recorded in, defaults to the shared one
     :return:
     """
     """
@@ -49,6 +57,7 @@ def create_embeddings(embedding_params, i):
     cbow_mean = embedding_params['cbow_mean']  # if using cbow
     iters = embedding_params['w2v_iters']  # epochs
 
+    start_time = time.time()
     w2v_model = Word2Vec(
         min_count=min_count,
         max_vocab_size=max_vocab_size,
@@ -58,7 +67,15 @@ def create_embeddings(embedding_params, i):
         negative=noise_words,
         cbow_mean=cbow_mean)
     sentences = MyCorpus()
-    w2v_model.build_vocab(sentences, progress_per=100000)
+    streaming_vocab_k = embedding_params.get('streaming_vocab_k', None)
+    if streaming_vocab_k:
+        # bounded-memory counts instead of gensim's exact counter and its lossy max_vocab_size pruning
+        summary = count_csv(sentences.path, int(streaming_vocab_k), tokenize=utils.simple_preprocess,
+                            n_workers=embedding_params.get('vocab_workers', 1))
+        word_freq = dict(summary.most_common(int(max_vocab_size)))
+        w2v_model.build_vocab_from_freq(word_freq, corpus_count=summary.n_docs)
+    else:
+        w2v_model.build_vocab(sentences, progress_per=100000)
     w2v_model.train(sentences, total_examples=w2v_model.corpus_count, epochs=iters, report_delay=1)
 
     if use_skip_gram:
@@ -70,17 +87,68 @@ def create_embeddings(embedding_params, i):
     path_to_embeddings_file = os.path.join(path_to_embeddings_file, "data")
     path_to_embeddings_file = os.path.join(path_to_embeddings_file, save_name)
     w2v_model.wv.save_word2vec_format(path_to_embeddings_file)
+    # keep the full model around so that training can be continued on new tweets
+    w2v_model.save(os.path.splitext(path_to_embeddings_file)[0] + ".w2v")
 
+    if store is None:
+        store = ResultsStore()
+    store.add_run('word2vec', os.path.splitext(save_name)[0], embedding_params,
+                  {'vocab_size': len(w2v_model.wv.vocab)},
+                  duration=time.time() - start_time,
+                  artifacts={'vectors': path_to_embeddings_file,
+                             'model': os.path.splitext(path_to_embeddings_file)[0] + ".w2v"})
 
-def load_vectors(fname):
+
+def update_embeddings(vector_name, new_data_path, epochs=None):
     """
+    Continue training the word2vec model behind pretrained vectors on new sentences only.
+    New words are added to the model vocab, existing word vectors keep their indices.
+    The full model is expected next to the vectors with the extension .w2v, it is
+    saved there by create_embeddings and word2vec/main.py.
+    :param vector_name: pretrained vectors as passed to load_vectors, i.e. params['pretrained_vectors']
+    :param new_data_path: csv file holding only the new processed tweets
+    :param epochs: number of passes over the new sentences, defaults to the original value
+    :return:
+    """
+    path_to_embeddings_file = vectors_path(vector_name)
+    path_to_model = os.path.splitext(path_to_embeddings_file)[0] + ".w2v"
+    if not os.path.exists(path_to_model):
+        raise FileNotFoundError(f"No word2vec model {path_to_model} saved with the vectors {vector_name}")
+    w2v_model = Word2Vec.load(path_to_model)
+    old_vocab_size = len(w2v_model.wv.vocab)
+
+    sentences = MyCorpus(path=new_data_path)
+    w2v_model.build_vocab(sentences, update=True, progress_per=100000)
+    print(f"Vocab grew from {old_vocab_size} to {len(w2v_model.wv.vocab)} words")
+    if epochs is None:
+        epochs = w2v_model.epochs
+    w2v_model.train(sentences, total_examples=w2v_model.corpus_count, epochs=epochs, report_delay=1)
+
+    w2v_model.wv.save_word2vec_format(path_to_embeddings_file)
+    w2v_model.save(path_to_model)
+    # torchtext caches the parsed vectors, drop the stale cache
+    if os.path.exists(path_to_embeddings_file + ".pt"):
+        os.remove(path_to_embeddings_file + ".pt")
 
+
+def vectors_path(fname):
+    """
+    Path of the pretrained vectors read by load_vectors
     :param fname:
     :return:
     """
     path_to_embeddings_file = os.path.normpath(os.getcwd() + os.sep + os.pardir)
-    #print(f"path_to_embeddings_file {path_to_embeddings_file}")
     path_to_embeddings_file = os.path.join(path_to_embeddings_file, "data")
+    return os.path.join(path_to_embeddings_file, fname)
+
+
+def load_vectors(fname):
+    """
+
+    :param fname:
+    :return:
+    """
+    path_to_embeddings_file = os.path.dirname(vectors_path(fname))
     print(f"path_to_embeddings_file {path_to_embeddings_file}, {fname}")
     vectors = Vectors(name=f"{fname}",
                       cache=path_to_embeddings_file)
@@ -1,14 +1,103 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence
 
+class HashedEmbedding(nn.Embedding):
+    """
+    Embedding with top_k dedicated rows in weight and n_buckets hash rows in buckets.
+    With num_hashes=2 an index above top_k packs two buckets whose rows are summed.
+    The buckets have no pretrained vectors, they are a separate parameter that stays
+    trainable when weight is frozen.
+    """
+
+    def __init__(self, top_k, n_buckets, embedding_dim, padding_idx=None, num_hashes=1, sparse=False):
+        super().__init__(top_k, embedding_dim, padding_idx=padding_idx, sparse=sparse)
+        self.top_k = top_k
+        self.n_buckets = n_buckets
+        self.num_hashes = num_hashes
+        self.buckets = nn.Parameter(torch.Tensor(n_buckets, embedding_dim).normal_(std=0.1))
+
+    def forward(self, text):
+        hashed = text >= self.top_k
+        offset = (text - self.top_k).clamp(min=0)
+        # hashed positions look up row 0 and non-hashed ones bucket 0, torch.where drops both
+        words = super().forward(text.masked_fill(hashed, 0))
+        if self.num_hashes == 1:
+            buckets = F.embedding(offset, self.buckets)
+        else:
+            buckets = F.embedding(offset // self.n_buckets, self.buckets) + \
+                      F.embedding(offset % self.n_buckets, self.buckets)
+        return torch.where(hashed.unsqueeze(-1), buckets, words)
+
+
+class PQEmbedding(nn.Module):
+    """
+    Frozen embedding stored as product-quantized uint8 codes, rows are
+    reconstructed from the codebooks on lookup. See quantization.train_pq.
+    """
+
+    sparse = False
+
+    def __init__(self, codebooks, codes, padding_idx=None):
+        super().__init__()
+        self.register_buffer('codebooks', torch.as_tensor(codebooks, dtype=torch.float))
+        self.register_buffer('codes', torch.as_tensor(codes, dtype=torch.uint8))
+        self.padding_idx = padding_idx
+        self.n_subspaces = self.codebooks.shape[0]
+        self.embedding_dim = self.n_subspaces * self.codebooks.shape[2]
+
+    def forward(self, text):
+        # uint8 tensors index as masks, so codes have to be cast to long
+        codes = self.codes[text].long()
+        subspaces = torch.arange(self.n_subspaces, device=codes.device)
+        embedded = self.codebooks[subspaces, codes].view(*text.shape, self.embedding_dim)
+        if self.padding_idx is not None:
+            embedded = embedded * (text != self.padding_idx).unsqueeze(-1).float()
+        return embedded
+
+
+def make_embedding(vocab_size, embedding_dim, pad_idx, hash_buckets=0, num_hashes=1, sparse=False):
+    if hash_buckets:
+        # vocab_size includes the hash buckets, see hashed_vocab.HashedVocab
+        return HashedEmbedding(vocab_size - hash_buckets, hash_buckets, embedding_dim,
+                               padding_idx=pad_idx, num_hashes=num_hashes, sparse=sparse)
+    # sparse=True: only the rows of the batch get gradients, see get_optimizer
+    return nn.Embedding(vocab_size, embedding_dim, padding_idx=pad_idx, sparse=sparse)
+
+
+def extend_embedding(embedding, new_vocab_size, new_vectors=None):
+    """
+    Copy of embedding grown to new_vocab_size rows. Existing rows keep their
+    indices and values, new rows are taken from new_vectors or initialised randomly.
+    :param embedding:
+    :param new_vocab_size:
+    :param new_vectors: tensor of shape (new_vocab_size - old_vocab_size, embedding_dim)
+    :return:
+    """
+    old_vocab_size, embedding_dim = embedding.weight.shape
+    if new_vocab_size <= old_vocab_size:
+        return embedding
+
+    extended = nn.Embedding(new_vocab_size, embedding_dim,
+                            padding_idx=embedding.padding_idx,
+                            sparse=embedding.sparse)
+    extended = extended.to(embedding.weight.device)
+    extended.weight.data[:old_vocab_size] = embedding.weight.data
+    if new_vectors is not None:
+        extended.weight.data[old_vocab_size:] = new_vectors
+    extended.weight.requires_grad = embedding.weight.requires_grad
+    return extended
+
+
 class RNNModel(nn.Module):
     """
 
     """
 
     def __init__(self, vocab_size, embedding_dim, hidden_dim,
-                 output_dim, n_layers, bidirectional, dropout, pad_idx, use_gru=True):
+                 output_dim, n_layers, bidirectional, dropout, pad_idx, use_gru=True,
+                 hash_buckets=0, num_hashes=1, sparse=False):
         super().__init__()
         self.n_hidden = hidden_dim
         self.n_layers = n_layers
@@ -18,7 +107,8 @@ class RNNModel(nn.Module):
         else:
             self.direction = 1
 
-        self.embedding = nn.Embedding(vocab_size, embedding_dim, padding_idx=pad_idx)
+        self.embedding = make_embedding(vocab_size, embedding_dim, pad_idx,
+                                        hash_buckets=hash_buckets, num_hashes=num_hashes, sparse=sparse)
         if use_gru:
             self.rnn = nn.GRU(embedding_dim,
                               hidden_dim,
@@ -53,3 +143,69 @@ class RNNModel(nn.Module):
         x = self.fc(x.squeeze(0))
         # print(f"x.shape {x.shape} {x}")
         return x
+
+    def extend_embedding(self, new_vocab_size, new_vectors=None):
+        self.embedding = extend_embedding(self.embedding, new_vocab_size, new_vectors)
+
+
+class BagModel(nn.Module):
+    """
+    Cheap fast-path classifier: mean and max pooled embeddings followed by a small MLP.
+    Takes the same inputs as RNNModel so it can be trained with the same loop.
+    """
+
+    def __init__(self, vocab_size, embedding_dim, hidden_dim, output_dim, dropout, pad_idx,
+                 hash_buckets=0, num_hashes=1, sparse=False):
+        super().__init__()
+        self.pad_idx = pad_idx
+        self.embedding = make_embedding(vocab_size, embedding_dim, pad_idx,
+                                        hash_buckets=hash_buckets, num_hashes=num_hashes, sparse=sparse)
+        self.fc1 = nn.Linear(2 * embedding_dim, hidden_dim)
+        self.fc2 = nn.Linear(hidden_dim, output_dim)
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, text, text_lengths):
+        embedded_text = self.dropout(self.embedding(text))
+        mask = (text != self.pad_idx).unsqueeze(-1).float()
+        n_tokens = mask.sum(dim=1).clamp(min=1)
+        mean_pooled = (embedded_text * mask).sum(dim=1) / n_tokens
+        max_pooled = (embedded_text - (1 - mask) * 1e4).max(dim=1)[0]
+        x = torch.relu(self.fc1(torch.cat((mean_pooled, max_pooled), dim=1)))
+        return self.fc2(self.dropout(x))
+
+    def extend_embedding(self, new_vocab_size, new_vectors=None):
+        self.embedding = extend_embedding(self.embedding, new_vocab_size, new_vectors)
+
+
+def build_model(params, vocab_size, embedding_dim, pad_idx, sparse=False):
+    """
+    RNNModel or BagModel for params['MODEL_TYPE'], with the layers analyse_sentiments trains
+    :param params:
+    :param vocab_size:
+    :param embedding_dim:
+    :param pad_idx:
+    :param sparse:
+    :return:
+    """
+    if params.get('MODEL_TYPE', 'rnn') == 'bag':
+        return BagModel(vocab_size=vocab_size,
+                        embedding_dim=embedding_dim,
+                        hidden_dim=params.get('BAG_HIDDEN_DIM', 64),
+                        output_dim=1,
+                        dropout=params['RNN_DROPOUT'],
+                        pad_idx=pad_idx,
+                        hash_buckets=params.get('HASH_BUCKETS', 0),
+                        num_hashes=params.get('HASH_NUM_HASHES', 1),
+                        sparse=sparse)
+    return RNNModel(vocab_size=vocab_size,
+                    embedding_dim=embedding_dim,
+                    hidden_dim=params['RNN_HIDDEN_DIM'],
+                    output_dim=1,
+                    n_layers=params['RNN_N_LAYERS'],
+                    bidirectional=True,
+                    dropout=params['RNN_DROPOUT'],
+                    pad_idx=pad_idx,
+                    use_gru=params['RNN_USE_GRU'],
+                    hash_buckets=params.get('HASH_BUCKETS', 0),
+                    num_hashes=params.get('HASH_NUM_HASHES', 1),
+                    sparse=sparse)
@@ -0,0 +1,82 @@
+from dedup import hash64
+
+
+def bucket_ids(word, top_k, n_buckets, num_hashes=1):
+    """
+    Index of a word outside the top-k vocab. With two hashes both bucket numbers
+    are packed into one index that HashedEmbedding decodes again.
+    :param word:
+    :param top_k: number of words with dedicated embedding rows
+    :param n_buckets:
+    :param num_hashes: 1 or 2
+    :return:
+    """
+    h = hash64(word)
+    h1 = (h & 0xffffffff) % n_buckets
+    if num_hashes == 1:
+        return top_k + h1
+    h2 = (h >> 32) % n_buckets
+    return top_k + h1 * n_buckets + h2
+
+
+class HashedStoi(object):
+    """
+    Drop-in replacement for vocab.stoi: known words keep their index,
+    every other word is hashed to one of n_buckets rows after the top-k words.
+    """
+
+    def __init__(self, stoi, top_k, n_buckets, num_hashes=1):
+        self.known = dict(stoi)
+        self.top_k = top_k
+        self.n_buckets = n_buckets
+        self.num_hashes = num_hashes
+
+    def __getitem__(self, word):
+        index = self.known.get(word)
+        if index is None:
+            index = bucket_ids(word, self.top_k, self.n_buckets, self.num_hashes)
+        return index
+
+    def get(self, word, default=None):
+        return self[word]
+
+    def __contains__(self, word):
+        return word in self.known
+
+    def __len__(self):
+        return len(self.known)
+
+
+class HashedVocab(object):
+    """
+    Vocab with dedicated rows for the top-k frequent words and a fixed number
+    of hash buckets shared by the long tail and words unseen at training time.
+    """
+
+    def __init__(self, vocab, n_buckets, num_hashes=1):
+        self.freqs = vocab.freqs
+        self.top_k = len(vocab.itos)
+        self.n_buckets = n_buckets
+        self.num_hashes = num_hashes
+        self.itos = list(vocab.itos) + [f"<hash_{i}>" for i in range(n_buckets)]
+        self.stoi = HashedStoi(vocab.stoi, self.top_k, n_buckets, num_hashes)
+        # vectors of the top-k words only, the bucket rows are initialised by HashedEmbedding
+        self.vectors = vocab.vectors
+
+    def __len__(self):
+        return len(self.itos)
+
+
+def max_top_k(max_mb, embedding_dim, n_buckets):
+    """
+    Number of dedicated rows that fit together with the hash buckets in an
+    embedding table of at most max_mb megabytes of float32.
+    :param max_mb:
+    :param embedding_dim:
+    :param n_buckets:
+    :return:
+    """
+    max_rows = int(max_mb * 1024 * 1024 / (4 * embedding_dim))
+    if max_rows <= n_buckets:
+        raise ValueError(f"{n_buckets} hash buckets of dim {embedding_dim} do not fit in {max_mb} MB")
+    return max_rows - n_buckets
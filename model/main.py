@@ -6,6 +6,7 @@ from embeddings import create_embeddings
 from torchtext_sentiment import analyse_sentiments
 from preprocessing import preprocess_text
 from utils import get_model_name
+from results_store import ResultsStore
 
 
 # INPUTS
@@ -64,6 +65,7 @@ if TRAINING_MODULE:
     print(f"Number of items in parameter grid {len(param_grid)}")
 
     test_accs = []
+    store = ResultsStore()
     for i, param in enumerate(param_grid):
         print(f"params {param}")
         model_name = get_model_name(param)
@@ -73,6 +75,8 @@ if TRAINING_MODULE:
                                                  model_name=model_name)
         end_time = time.time()
         print(f"Training lasted for {round((end_time - start_time) / 60, 1)} min")
+        store.add_classifier_run(model_name, param, {'test_loss': test_loss, 'test_acc': test_acc},
+                                 duration=end_time - start_time)
 
         test_accs.append(test_acc)
 
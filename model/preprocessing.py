@@ -5,6 +5,8 @@ import numpy as np
 import pandas as pd
 import re
 
+from dedup import deduplicate, report_dedup
+
 
 def decode_sentiment(label):
     decode_map = {0: 0, 2: "NEUTRAL", 4: 1}
@@ -36,10 +38,12 @@ def preprocess(text, stop_words, stem=False, stemmer=None):
     return " ".join(tokens)
 
 
-def preprocess_text(dataset_path, remove_stop_words=False):
+def preprocess_text(dataset_path, remove_stop_words=False, stem=False, dedup=True, near_duplicates=True):
     """
 
     :param dataset_path:
+    :param dedup: drop duplicate tweets before splitting so they cannot leak between train/val/test
+    :param near_duplicates: also collapse near-duplicates (retweets etc.) with MinHash/LSH
     :return:
     """
     print(f"Preprocessing twitter dataset. "
@@ -62,7 +66,7 @@ def preprocess_text(dataset_path, remove_stop_words=False):
         stop_words = set(stopwords.words('english'))
         df.text = df.text.apply(lambda x: preprocess(x, stop_words))
     else:
-        df.text = df.text.apply(lambda x: preprocess(x))
+        df.text = df.text.apply(lambda x: preprocess(x, set()))
     
 
     print(f"Preprocessing results in empty tweets. Dropping empty sentences")
@@ -70,6 +74,13 @@ def preprocess_text(dataset_path, remove_stop_words=False):
     df.replace("", nan_value, inplace=True)
     df.dropna(axis=0, inplace=True)
 
+    if dedup:
+        print(f"Removing duplicate tweets")
+        texts_before = df.text
+        keep = np.fromiter(deduplicate(df.text, near_duplicates=near_duplicates), dtype=bool, count=len(df))
+        df = df[keep]
+        report_dedup(texts_before, df.text)
+
     print(f"Splitting data")
     # Split in to train val test
     df_train, df_test = train_test_split(df, test_size=0.2, random_state=10, shuffle=True, stratify=df.target)
@@ -0,0 +1,52 @@
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+
+def train_pq(matrix, n_subspaces=50, n_centroids=256, n_train=100000, chunk_rows=100000, seed=10):
+    """
+    Product quantization of an embedding matrix. Every row is split into n_subspaces
+    parts and each part is replaced by the index of its nearest k-means centroid.
+    :param matrix: n_words x dim float matrix, dim has to be divisible by n_subspaces
+    :param n_subspaces:
+    :param n_centroids: at most 256 so that codes fit in uint8
+    :param n_train: rows sampled for fitting the codebooks
+    :param chunk_rows: rows encoded at a time
+    :param seed:
+    :return: codebooks (n_subspaces, n_centroids, dim / n_subspaces) float32, codes (n_words, n_subspaces) uint8
+    """
+    n_words, dim = matrix.shape
+    if dim % n_subspaces != 0:
+        raise ValueError(f"Embedding dim {dim} is not divisible by {n_subspaces} subspaces")
+    if n_centroids > 256:
+        raise ValueError(f"{n_centroids} centroids do not fit in uint8 codes")
+    sub_dim = dim // n_subspaces
+    n_centroids = min(n_centroids, n_words)
+
+    rng = np.random.RandomState(seed)
+    sample = matrix[np.sort(rng.choice(n_words, min(n_train, n_words), replace=False))]
+
+    codebooks = np.empty((n_subspaces, n_centroids, sub_dim), dtype=np.float32)
+    codes = np.empty((n_words, n_subspaces), dtype=np.uint8)
+    for m in range(n_subspaces):
+        kmeans = MiniBatchKMeans(n_clusters=n_centroids, random_state=seed, n_init=3)
+        kmeans.fit(sample[:, m * sub_dim:(m + 1) * sub_dim])
+        codebooks[m] = kmeans.cluster_centers_
+        for start in range(0, n_words, chunk_rows):
+            end = min(start + chunk_rows, n_words)
+            codes[start:end, m] = kmeans.predict(matrix[start:end, m * sub_dim:(m + 1) * sub_dim])
+    return codebooks, codes
+
+
+def decode_pq(codebooks, codes):
+    n_subspaces = codebooks.shape[0]
+    return np.concatenate([codebooks[m][codes[:, m]] for m in range(n_subspaces)], axis=1)
+
+
+def compression_ratio(n_words, dim, n_subspaces, n_centroids=256):
+    """
+    float32 table size divided by the size of uint8 codes plus float32 codebooks
+    :return:
+    """
+    float_bytes = n_words * dim * 4
+    pq_bytes = n_words * n_subspaces + n_centroids * dim * 4
+    return float_bytes / pq_bytes
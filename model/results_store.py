@@ -0,0 +1,125 @@
+import json
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+# one store for the word2vec and the classifier runs, independent of the working directory
+RESULTS_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data",
+                                            "results.sqlite"))
+
+
+class ResultsStore(object):
+    """
+    Append-only SQLite store for word2vec and classifier runs. Every run is one
+    transaction, so a crash loses at most the run being written.
+    """
+
+    def __init__(self, path=RESULTS_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                           id INTEGER PRIMARY KEY,
+                                           kind TEXT,
+                                           name TEXT,
+                                           params TEXT,
+                                           created REAL,
+                                           duration REAL,
+                                           artifacts TEXT)""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS metrics (
+                                           run_id INTEGER REFERENCES runs(id),
+                                           name TEXT,
+                                           value REAL)""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS metrics_by_value ON metrics (name, value)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS metrics_by_run ON metrics (run_id)")
+
+    def add_run(self, kind, name, params, metrics, duration=None, artifacts=None):
+        """
+        Stores one run
+        :param kind: 'word2vec' or 'classifier'
+        :param name: run or model name
+        :param params: dict of parameters
+        :param metrics: dict of metric name to number
+        :param duration: seconds
+        :param artifacts: dict of artifact name to path, e.g. vectors or checkpoint
+        :return: id of the run
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (kind, name, params, created, duration, artifacts) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, name, json.dumps(params, default=str), time.time(), duration,
+                 json.dumps(artifacts or {})))
+            run_id = cursor.lastrowid
+            self.connection.executemany("INSERT INTO metrics (run_id, name, value) VALUES (?, ?, ?)",
+                                        [(run_id, metric, float(value)) for metric, value in metrics.items()])
+        return run_id
+
+    def add_classifier_run(self, model_name, params, metrics, duration=None):
+        """
+        Stores a run of analyse_sentiments or update_sentiments with the files it saved
+        :param model_name:
+        :param params:
+        :param metrics:
+        :param duration: seconds
+        :return: id of the run
+        """
+        return self.add_run('classifier', model_name, params, metrics, duration=duration,
+                            artifacts={'checkpoint': f"{model_name}.pt",
+                                       'vocab': f"{model_name}_vocab.pt",
+                                       'label_vocab': f"{model_name}_label_vocab.pt"})
+
+    def get_run(self, run_id):
+        kind, name, params, created, duration, artifacts = self.connection.execute(
+            "SELECT kind, name, params, created, duration, artifacts FROM runs WHERE id = ?", (run_id,)).fetchone()
+        metrics = dict(self.connection.execute("SELECT name, value FROM metrics WHERE run_id = ?", (run_id,)))
+        return {'id': run_id, 'kind': kind, 'name': name, 'params': json.loads(params), 'created': created,
+                'duration': duration, 'artifacts': json.loads(artifacts), 'metrics': metrics}
+
+    def latest(self, name, kind=None):
+        """
+        The most recent run with the given name, or None
+        :param name:
+        :param kind:
+        :return:
+        """
+        query = "SELECT id FROM runs WHERE name = ?" + (" AND kind = ?" if kind is not None else "")
+        row = self.connection.execute(query + " ORDER BY id DESC LIMIT 1",
+                                      [name] + ([kind] if kind is not None else [])).fetchone()
+        return None if row is None else self.get_run(row[0])
+
+    def best(self, metric, k=5, kind=None, descending=True):
+        """
+        The k runs with the highest (or lowest) value of metric
+        :param metric:
+        :param k:
+        :param kind: optionally only 'word2vec' or 'classifier' runs
+        :param descending:
+        :return: list of runs as dicts
+        """
+        query = "SELECT metrics.run_id FROM metrics JOIN runs ON runs.id = metrics.run_id WHERE metrics.name = ?"
+        args = [metric]
+        if kind is not None:
+            query += " AND runs.kind = ?"
+            args.append(kind)
+        query += f" ORDER BY metrics.value {'DESC' if descending else 'ASC'} LIMIT ?"
+        args.append(k)
+        return [self.get_run(run_id) for (run_id,) in self.connection.execute(query, args)]
+
+    def to_dataframe(self, kind=None):
+        """
+        All runs with one column per metric, e.g. for the notebooks
+        :param kind:
+        :return:
+        """
+        query = "SELECT id FROM runs" + (" WHERE kind = ?" if kind is not None else "") + " ORDER BY id"
+        rows = []
+        for (run_id,) in self.connection.execute(query, [kind] if kind is not None else []):
+            run = self.get_run(run_id)
+            rows.append(dict(model=run['name'], duration=run['duration'], **run['metrics']))
+        return pd.DataFrame(rows)
+
+    def close(self):
+        self.connection.close()
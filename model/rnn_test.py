@@ -2,10 +2,11 @@ import os
 from sklearn.model_selection import ParameterGrid
 import time
 
-from embeddings import create_embeddings
+from embeddings import create_embeddings, update_embeddings
 from preprocessing import preprocess_text
-from torchtext_sentiment import analyse_sentiments
+from torchtext_sentiment import analyse_sentiments, update_sentiments
 from utils import get_model_name
+from results_store import ResultsStore
 
 
 # INPUTS
@@ -13,8 +14,12 @@ from utils import get_model_name
 PROCESS_DATASETS = False
 CREATE_EMBEDDINGS = False
 TRAINING_MODULE = True
+UPDATE_MODULE = False  # fine-tune saved models on new tweets only
 training_mode = True
 
+# word2vec and classifier runs, see ResultsStore.best and to_dataframe
+store = ResultsStore()
+
 if PROCESS_DATASETS:
     dataset_path = os.path.normpath(os.getcwd() + os.sep + os.pardir)
     dataset_path = os.path.join(dataset_path, "data")
@@ -39,32 +44,47 @@ if CREATE_EMBEDDINGS:
     print(f"Number of items in parameter grid {len(param_grid_emb)}")
     for i, param in enumerate(param_grid_emb):
         print(f"{i+1}/{len(param_grid_emb)} Creating word2vec model with params {param}")
-        create_embeddings(param, i)
+        create_embeddings(param, i, store=store)
 
     # TODO TEST EMBEDDINGS AND PLOT RESULTS
 
-if TRAINING_MODULE:
-    params = [
-        {'MAX_VOCAB_SIZE': [500e3],  # needs to match pretrained word2vec model params
-         'min_freq': [1],  # needs to match pretrained word2vec model params
-         'embedding_dim': [300],  # only needed if not pretrained
-         'pretrained_vectors': [
-              #None,
-             'with_stops_cbow_True_window_8_size_300_noise_20_iters_30_accuracy_0.2138377641445126.kv',
-             'with_stops_cbow_True_window_8_size_600_noise_2_iters_10_accuracy_0.05248807089297887.kv'
-             ], 
-         'RNN_FREEZE_EMDEDDINGS': [True],  # freeze
-         'RNN_HIDDEN_DIM': [256],  # 128 tai 256
-         'RNN_N_LAYERS': [1],  # 3 layers in  Howard et. al (2018)
-         'RNN_DROPOUT': [0.4],  # 0.4put
-         'RNN_USE_GRU': [False],  # True: use GRU, False: use LSTM
-         'RNN_BATCH_SIZE': [128],  # Kagglessa käytettiin 1024
-         'RNN_EPOCHS': [10]  # onko riittävä?
-         }]
+# shared by the training and the update module
+params = [
+    {'MAX_VOCAB_SIZE': [500e3],  # needs to match pretrained word2vec model params
+     'min_freq': [1],  # needs to match pretrained word2vec model params
+     'STREAMING_VOCAB_K': [None],  # e.g. 1e6: count vocab with a bounded Misra-Gries summary
+     'embedding_dim': [300],  # only needed if not pretrained
+     'pretrained_vectors': [
+          #None,
+         'with_stops_cbow_True_window_8_size_300_noise_20_iters_30_accuracy_0.2138377641445126.kv',
+         'with_stops_cbow_True_window_8_size_600_noise_2_iters_10_accuracy_0.05248807089297887.kv'
+         ], 
+     'RNN_FREEZE_EMDEDDINGS': [True],  # freeze
+     'RNN_SPARSE_EMBEDDINGS': [False],  # sparse gradients + SparseAdam for unfrozen embeddings
+     'PQ_SUBSPACES': [None],  # e.g. [None, 50]: compare float32 and product-quantized frozen embeddings
+     'RNN_HIDDEN_DIM': [256],  # 128 tai 256
+     'RNN_N_LAYERS': [1],  # 3 layers in  Howard et. al (2018)
+     'RNN_DROPOUT': [0.4],  # 0.4put
+     'RNN_USE_GRU': [False],  # True: use GRU, False: use LSTM
+     'MODEL_TYPE': ['rnn'],  # 'bag': mean/max pooled embeddings + MLP instead of the RNN
+     'DISTILL_BAG': [False],  # distill a bag model from the trained RNN and compare speed/accuracy
+     'CASCADE_THRESHOLD': [None],  # e.g. 0.3: escalate tweets with |p - 0.5| < 0.3 to the RNN
+     'RNN_BATCH_SIZE': [128],  # Kagglessa käytettiin 1024
+     'RNN_ACCUMULATION_STEPS': [1],  # e.g. 8 with batch size 128 for an effective batch of 1024
+     'RNN_LR_SCALING': [False],  # scale the learning rate linearly with RNN_ACCUMULATION_STEPS
+     'RNN_WARMUP_STEPS': [0],  # linear learning rate warm-up over this many optimizer steps
+     'RNN_MAX_TOKENS': [None],  # e.g. 4096: batches of at most this many padded tokens
+     'RNN_MAX_LEN': [None],  # cap on tokens per tweet
+     'RNN_EPOCHS': [10],  # onko riittävä?
+     'HASH_BUCKETS': [0],  # 0: plain vocab, >0: words outside MAX_VOCAB_SIZE share hash buckets
+     'HASH_NUM_HASHES': [1],  # 2: sum of two bucket rows, fewer collisions
+     'EMBEDDING_MAX_MB': [None]  # memory ceiling for the hashed embedding table
+     }]
 
-    param_grid = list(ParameterGrid(params))
-    print(f"Number of items in parameter grid {len(param_grid)}")
+param_grid = list(ParameterGrid(params))
+print(f"Number of items in parameter grid {len(param_grid)}")
 
+if TRAINING_MODULE:
     test_accs = []
     for i, param in enumerate(param_grid):
         print(f"params {param}")
@@ -76,9 +96,28 @@ if TRAINING_MODULE:
                                                  training_mode=training_mode)
         end_time = time.time()
         print(f"Training lasted for {round((end_time - start_time) / 60, 1)} min")
+        store.add_classifier_run(model_name, param, {'test_loss': test_loss, 'test_acc': test_acc},
+                                 duration=end_time - start_time)
         test_accs.append(test_acc)
 
     for i, param in enumerate(param_grid):
         print(f"param {param}")
         print(f"test accuracy: {test_accs[i]}")
 
+if UPDATE_MODULE:
+    # processed_new.csv holds only the tweets collected since the last run,
+    # the word2vec models go first so that the classifiers find vectors for the new words
+    for vector_name in sorted({param['pretrained_vectors'] for param in param_grid} - {None}):
+        print(f"updating {vector_name}")
+        update_embeddings(vector_name, "../data/processed_new.csv")
+    for i, param in enumerate(param_grid):
+        model_name = get_model_name(param)
+        print(f"{i+1}/{len(param_grid)} updating {model_name}")
+        start_time = time.time()
+        val_loss, val_acc = update_sentiments(params=param,
+                                              model_name=model_name,
+                                              new_data='processed_new.csv')
+        end_time = time.time()
+        print(f"Update lasted for {round((end_time - start_time) / 60, 1)} min")
+        store.add_classifier_run(model_name, param, {'val_loss': val_loss, 'val_acc': val_acc},
+                                 duration=end_time - start_time)
@@ -8,8 +8,12 @@ import torchtext.vocab
 from torchtext.data import TabularDataset
 
 from embeddings import load_vectors
-from utils import epoch_time
-from gru import RNNModel
+from utils import epoch_time, MultipleOptimizer, WarmupLR
+from gru import PQEmbedding, build_model
+from quantization import train_pq, compression_ratio
+from hashed_vocab import HashedVocab, max_top_k
+from batching import TokenBudget, Truncate
+from counting import count_csv
 
 import os
 from preprocessing import preprocess
@@ -18,7 +22,9 @@ from nltk.corpus import stopwords
 
 import matplotlib.pyplot as plt
 plt.switch_backend('agg')
+import copy
 import itertools
+from collections import Counter
 
 
 def binary_accuracy(preds, y):
@@ -134,10 +140,12 @@ def evaluate(model, iterator, criterion):
     """
     epoch_loss = 0
     epoch_acc = 0
+    n_batches = 0
 
     model.eval()
     with torch.no_grad():
         for batch in iterator:
+            n_batches += 1
             # print(batch.SentimentText)
             if batch.SentimentText.nelement() > 0:
 
@@ -154,7 +162,8 @@ def evaluate(model, iterator, criterion):
             # else:
             # print(f"Found a non-empty Tensorlist {batch.SentimentText}")
 
-    return epoch_loss / len(iterator), epoch_acc / len(iterator)
+    # len(iterator) is not defined for token-budget batches
+    return epoch_loss / max(n_batches, 1), epoch_acc / max(n_batches, 1)
 
 
 def evaluate_sentences(model, sentence, TEXT, device):
@@ -182,14 +191,24 @@ def evaluate_sentences(model, sentence, TEXT, device):
     return prediction.item()
 
 
-def train_epoch(model, iterator, optimizer, criterion, device):
+def train_epoch(model, iterator, optimizer, criterion, device, teacher=None, distill_alpha=0.5,
+                accumulation_steps=1, scheduler=None):
+    """
+
+    :param teacher: optional trained model whose soft predictions the model is distilled from
+    :param distill_alpha: weight of the teacher targets in the loss
+    :param accumulation_steps: batches whose gradients are summed before an optimizer step,
+        the effective batch size is accumulation_steps times the batch size
+    :param scheduler: optional utils.WarmupLR stepped after every optimizer step
+    """
     epoch_loss = 0
     epoch_acc = 0
+    n_batches = 0
 
     model.train()
-    #
+    optimizer.zero_grad()
     for text, y in iterator:
-        optimizer.zero_grad()
+        n_batches += 1
 
         # print(f"text is {text}")
         # print(f"text.shape is {text.shape}")
@@ -198,15 +217,209 @@ def train_epoch(model, iterator, optimizer, criterion, device):
         predictions = model(text, text_lengths).squeeze(1)
         # predictions = model(batch.SentimentText).squeeze(1)
         loss = criterion(predictions, y)
+        if teacher is not None:
+            with torch.no_grad():
+                soft_targets = torch.sigmoid(teacher(text, text_lengths).squeeze(1))
+            loss = (1 - distill_alpha) * loss + distill_alpha * criterion(predictions, soft_targets)
         acc = binary_accuracy(predictions, y)
 
-        loss.backward()
-        optimizer.step()
+        (loss / accumulation_steps).backward()
+        if n_batches % accumulation_steps == 0:
+            optimizer.step()
+            optimizer.zero_grad()
+            if scheduler is not None:
+                scheduler.step()
 
         epoch_loss += loss.item()
         epoch_acc += acc.item()
 
-    return model, epoch_loss / len(iterator), epoch_acc / len(iterator)
+    # left over micro-batches of the last incomplete step, their losses were divided by
+    # accumulation_steps, rescale to the mean over the micro-batches actually accumulated
+    leftover = n_batches % accumulation_steps
+    if leftover != 0:
+        for p in model.parameters():
+            if p.grad is not None:
+                p.grad.mul_(accumulation_steps / leftover)
+        optimizer.step()
+        optimizer.zero_grad()
+        if scheduler is not None:
+            scheduler.step()
+
+    return model, epoch_loss / max(n_batches, 1), epoch_acc / max(n_batches, 1)
+
+
+def fit(model, train_iterator, val_iterator, optimizer, criterion, device, n_epochs, save_name,
+        teacher=None, distill_alpha=0.5, accumulation_steps=1, scheduler=None, best_valid_loss=float('inf')):
+    """
+    Trains for n_epochs and keeps the state with the lowest validation loss in save_name.pt
+    :param best_valid_loss: save_name.pt is only written for states with a lower validation loss
+    :return:
+    """
+    if teacher is not None:
+        teacher.eval()
+    for epoch in range(n_epochs):
+        start_time = time.time()
+        model, train_loss, train_acc = train_epoch(model, train_iterator, optimizer, criterion, device,
+                                                   teacher=teacher, distill_alpha=distill_alpha,
+                                                   accumulation_steps=accumulation_steps, scheduler=scheduler)
+        valid_loss, valid_acc = evaluate(model, val_iterator, criterion)
+        end_time = time.time()
+
+        epoch_mins, epoch_secs = epoch_time(start_time, end_time)
+
+        if valid_loss < best_valid_loss:
+            best_valid_loss = valid_loss
+            torch.save(model.state_dict(), f"{save_name}.pt")
+
+        print(f'Epoch: {epoch + 1:02} | Epoch Time: {epoch_mins}m {epoch_secs}s')
+        print(f'\tTrain Loss: {train_loss:.3f} | Train Acc: {train_acc * 100:.2f}%')
+        print(f'\t Val. Loss: {valid_loss:.3f} |  Val. Acc: {valid_acc * 100:.2f}%')
+    return model
+
+
+def measure_throughput(model, iterator):
+    """
+    Tweets classified per second over the whole iterator
+    :return:
+    """
+    model.eval()
+    n_tweets = 0
+    start_time = time.time()
+    with torch.no_grad():
+        for batch in iterator:
+            if batch.SentimentText.nelement() > 0:
+                text_lengths = [len(seq) for seq in batch.SentimentText]
+                model(batch.SentimentText, text_lengths)
+                n_tweets += batch.SentimentText.shape[0]
+    return n_tweets / max(time.time() - start_time, 1e-9)
+
+
+def evaluate_cascade(fast_model, slow_model, iterator, threshold=0.3):
+    """
+    Classifies with fast_model and escalates only tweets whose probability is
+    within threshold of 0.5 to slow_model.
+    :return: accuracy, fraction of escalated tweets, tweets per second
+    """
+    fast_model.eval()
+    slow_model.eval()
+    n_correct = 0
+    n_tweets = 0
+    n_escalated = 0
+    start_time = time.time()
+    with torch.no_grad():
+        for batch in iterator:
+            if batch.SentimentText.nelement() == 0:
+                continue
+            text = batch.SentimentText
+            text_lengths = [len(seq) for seq in text]
+            predictions = fast_model(text, text_lengths).squeeze(1)
+            uncertain = (torch.sigmoid(predictions) - 0.5).abs() < threshold
+            if uncertain.any():
+                predictions[uncertain] = slow_model(text[uncertain], text_lengths[:int(uncertain.sum())]).squeeze(1)
+            n_correct += (torch.round(torch.sigmoid(predictions)) == batch.Sentiment).sum().item()
+            n_tweets += text.shape[0]
+            n_escalated += uncertain.sum().item()
+    elapsed = max(time.time() - start_time, 1e-9)
+    return n_correct / max(n_tweets, 1), n_escalated / max(n_tweets, 1), n_tweets / elapsed
+
+
+def get_optimizer(model, lr=1e-3):
+    """
+    Adam for the whole model, or SparseAdam for a trainable sparse embedding
+    and Adam for the dense RNN and linear parameters.
+    :param model:
+    :param lr:
+    :return:
+    """
+    if not (model.embedding.sparse and model.embedding.weight.requires_grad):
+        return optim.Adam(filter(lambda p: p.requires_grad, model.parameters()), lr=lr)
+    embedding = model.embedding.weight
+    dense_params = [p for p in model.parameters() if p is not embedding and p.requires_grad]
+    return MultipleOptimizer(optim.SparseAdam([embedding], lr=lr),
+                             optim.Adam(dense_params, lr=lr))
+
+
+def get_fields(max_len=None):
+    """
+    Text and label fields shared by the full training and the incremental update path
+    :param max_len: optional cap on the number of tokens per tweet
+    :return:
+    """
+    TEXT = torchtext.data.Field(lower=True,
+                                preprocessing=Truncate(max_len) if max_len else None,
+                                pad_first=True,
+                                batch_first=True,
+                                init_token='<sos>',
+                                eos_token='<eos>'
+                                # include_lengths=True
+                                )
+
+    LABEL = torchtext.data.LabelField(dtype=torch.float)
+    return TEXT, LABEL
+
+
+def save_vocabs(TEXT, LABEL, save_name):
+    """
+    Saves the text and label vocabs next to the checkpoint save_name.pt. The pretrained
+    vectors are left out, they are already in the embedding weights of the checkpoint.
+    :param TEXT:
+    :param LABEL:
+    :param save_name:
+    :return:
+    """
+    vocab = copy.copy(TEXT.vocab)
+    vocab.vectors = None
+    torch.save(vocab, f"{save_name}_vocab.pt")
+    torch.save(LABEL.vocab, f"{save_name}_label_vocab.pt")
+
+
+def build_vocab_from_counter(TEXT, counter, **kwargs):
+    """
+    Same as TEXT.build_vocab but from precomputed word counts, see counting.count_csv
+    :param TEXT:
+    :param counter:
+    :param kwargs: passed on to the vocab, e.g. max_size and vectors
+    :return:
+    """
+    specials = [tok for tok in [TEXT.unk_token, TEXT.pad_token, TEXT.init_token, TEXT.eos_token]
+                if tok is not None]
+    TEXT.vocab = TEXT.vocab_cls(counter, specials=specials, **kwargs)
+
+
+def extend_vocab(vocab, dataset, min_freq=1, vectors=None, only_pretrained=False):
+    """
+    Append words of dataset missing from vocab to the end of vocab.itos so that
+    the indices of already known words do not change.
+    :param vocab: torchtext vocab of the trained model
+    :param dataset: dataset holding only the new tweets
+    :param min_freq:
+    :param vectors: optional pretrained vectors for the new words
+    :param only_pretrained: only add words that have a pretrained vector, e.g. for frozen embeddings
+    :return: embedding rows for the new words or None
+    """
+    counter = Counter()
+    for example in dataset:
+        counter.update(example.SentimentText)
+    vocab.freqs.update(counter)
+
+    new_words = [word for word, freq in counter.most_common()
+                 if freq >= min_freq and word not in vocab.stoi]
+    if only_pretrained:
+        # frozen rows are never trained, words without a vector are better off as <unk>
+        new_words = [word for word in new_words if vectors is not None and word in vectors.stoi]
+    for word in new_words:
+        vocab.stoi[word] = len(vocab.itos)
+        vocab.itos.append(word)
+    print(f"Added {len(new_words)} new words to vocab, vocab size is {len(vocab.itos)}")
+
+    if vectors is None or len(new_words) == 0:
+        return None
+    # same initialisation as the words without a vector in analyse_sentiments
+    new_vectors = torch.stack([vectors[word] if word in vectors.stoi else torch.Tensor(vectors.dim).normal_()
+                               for word in new_words])
+    if vocab.vectors is not None:
+        vocab.vectors = torch.cat([vocab.vectors, new_vectors])
+    return new_vectors
 
 
 def analyse_sentiments(params=None,
@@ -225,6 +438,7 @@ def analyse_sentiments(params=None,
     EMBEDDING_DIM = params['embedding_dim']
 
     FREEZE_EMDEDDINGS = params['RNN_FREEZE_EMDEDDINGS']
+    SPARSE_EMBEDDINGS = params.get('RNN_SPARSE_EMBEDDINGS', False)  # only used if not frozen
     HIDDEN_DIM = params['RNN_HIDDEN_DIM']  # model_params['RNN_HIDDEN_DIM']
     OUTPUT_DIM = 1  # params['OUTPUT_DIM']
     N_LAYERS = params['RNN_N_LAYERS']   # model_params['RNN_N_LAYERS']
@@ -232,21 +446,15 @@ def analyse_sentiments(params=None,
     USE_GRU = params['RNN_USE_GRU']  # model_params['RNN_USE_GRU']
     N_EPOCHS = params['RNN_EPOCHS']
     BATCH_SIZE = params['RNN_BATCH_SIZE']
+    MAX_TOKENS = params.get('RNN_MAX_TOKENS', None)  # token budget per batch, replaces BATCH_SIZE
+    MODEL_TYPE = params.get('MODEL_TYPE', 'rnn')  # 'rnn' or 'bag' for the pooled embedding fast path
 
     pretrained = True
     if vector_name == None:
         pretrained = False
 
 
-    TEXT = torchtext.data.Field(lower=True,
-                                pad_first=True,
-                                batch_first=True,
-                                init_token='<sos>',
-                                eos_token='<eos>'
-                                # include_lengths=True
-                                )
-
-    LABEL = torchtext.data.LabelField(dtype=torch.float)
+    TEXT, LABEL = get_fields(max_len=params.get('RNN_MAX_LEN', None))
     datafields = [('Sentiment', LABEL), ('SentimentText', TEXT)]
     train_set, val_set, test_set = TabularDataset.splits(path='../data/',
                                     train='processed_train.csv',
@@ -258,15 +466,39 @@ def analyse_sentiments(params=None,
 
     if pretrained:
         vectors = load_vectors(fname=vector_name)
-        TEXT.build_vocab(train_set,
-                         vectors=vectors,
-                         unk_init=torch.Tensor.normal_)
+        EMBEDDING_DIM = vectors.dim
+
+    # hashed vocab: top-k words get own rows, the rest share HASH_BUCKETS rows
+    HASH_BUCKETS = params.get('HASH_BUCKETS', 0)
+    NUM_HASHES = params.get('HASH_NUM_HASHES', 1)
+    EMBEDDING_MAX_MB = params.get('EMBEDDING_MAX_MB', None)
+    if HASH_BUCKETS:
+        if EMBEDDING_MAX_MB is not None:
+            # max_size does not count the 4 special tokens
+            MAX_VOCAB_SIZE = min(MAX_VOCAB_SIZE, max_top_k(EMBEDDING_MAX_MB, EMBEDDING_DIM, HASH_BUCKETS) - 4)
+        MAX_VOCAB_SIZE = int(MAX_VOCAB_SIZE)
+
+    if pretrained:
+        vocab_kwargs = dict(max_size=MAX_VOCAB_SIZE if HASH_BUCKETS else None,
+                            vectors=vectors,
+                            unk_init=torch.Tensor.normal_)
+    else:
+        vocab_kwargs = dict(max_size=MAX_VOCAB_SIZE)
+    # bounded-memory heavy hitters instead of an exact counter over the whole train set
+    STREAMING_VOCAB_K = params.get('STREAMING_VOCAB_K', None)
+    if STREAMING_VOCAB_K:
+        summary = count_csv('../data/processed_train.csv', int(STREAMING_VOCAB_K),
+                            n_workers=params.get('VOCAB_WORKERS', 1))
+        build_vocab_from_counter(TEXT, summary.counter(), **vocab_kwargs)
+    else:
+        TEXT.build_vocab(train_set, **vocab_kwargs)
+    if HASH_BUCKETS:
+        TEXT.vocab = HashedVocab(TEXT.vocab, HASH_BUCKETS, num_hashes=NUM_HASHES)
+        print(f"Hashed vocab with {TEXT.vocab.top_k} words and {HASH_BUCKETS} buckets, "
+              f"embedding table {len(TEXT.vocab) * EMBEDDING_DIM * 4 / 1024 ** 2:.1f} MB")
+    if pretrained:
         vectors = TEXT.vocab.vectors
         # print(vectors.shape)
-        EMBEDDING_DIM = vectors.shape[1]
-    else:
-        TEXT.build_vocab(train_set,
-                         max_size=MAX_VOCAB_SIZE)
     LABEL.build_vocab(train_set)
     print(f"Most frequent words in vocab. {TEXT.vocab.freqs.most_common(20)}")
 
@@ -275,7 +507,8 @@ def analyse_sentiments(params=None,
     # minimise badding for each sentence
     train_iterator, val_iterator, test_iterator = torchtext.data.BucketIterator.splits(
                                                                         (train_set, val_set, test_set),
-                                                                        batch_size=BATCH_SIZE,
+                                                                        batch_size=MAX_TOKENS or BATCH_SIZE,
+                                                                        batch_size_fn=TokenBudget() if MAX_TOKENS else None,
                                                                         sort_key=lambda x: len(x.SentimentText),
                                                                         sort_within_batch=False,
                                                                         device=device)
@@ -283,15 +516,8 @@ def analyse_sentiments(params=None,
     pad_idx = TEXT.vocab.stoi[TEXT.pad_token]
     INPUT_DIM = len(TEXT.vocab)
     print(f"Vocab size is {INPUT_DIM}, emdebbing dim is {EMBEDDING_DIM}")
-    model = RNNModel(vocab_size=INPUT_DIM,
-                    embedding_dim=EMBEDDING_DIM,
-                    hidden_dim=HIDDEN_DIM,
-                    output_dim=OUTPUT_DIM,
-                    n_layers=N_LAYERS,
-                    bidirectional=True,
-                    dropout=DROPOUT,
-                    pad_idx=pad_idx,
-                    use_gru=USE_GRU)
+    model = build_model(params, INPUT_DIM, EMBEDDING_DIM, pad_idx,
+                        sparse=SPARSE_EMBEDDINGS and not FREEZE_EMDEDDINGS)
     print(model)
 
     if pretrained:
@@ -304,34 +530,40 @@ def analyse_sentiments(params=None,
     model.embedding.weight.data[unk_idx] = torch.zeros(EMBEDDING_DIM)
     model.embedding.weight.data[pad_idx] = torch.zeros(EMBEDDING_DIM)
 
-    # freeze embeddings
+    # freeze embeddings, the hash buckets of a hashed vocab stay trainable
     if FREEZE_EMDEDDINGS:
         model.embedding.weight.requires_grad = False
     else:
         model.embedding.weight.requires_grad = True
 
-    optimizer = optim.Adam(model.parameters(), lr=1e-3)
+    # replace the frozen float32 table with product-quantized codes
+    PQ_SUBSPACES = params.get('PQ_SUBSPACES', None)
+    if PQ_SUBSPACES:
+        if not FREEZE_EMDEDDINGS or HASH_BUCKETS:
+            raise ValueError("Product quantization needs frozen embeddings without hash buckets, "
+                             "the bucket rows are trained")
+        codebooks, codes = train_pq(model.embedding.weight.data.numpy(), n_subspaces=PQ_SUBSPACES)
+        model.embedding = PQEmbedding(codebooks, codes, padding_idx=pad_idx)
+        print(f"Product quantized embedding with {PQ_SUBSPACES} subspaces, compression ratio "
+              f"{compression_ratio(INPUT_DIM, EMBEDDING_DIM, PQ_SUBSPACES, codebooks.shape[1]):.1f}x")
+
+    # gradient accumulation: effective batch of ACCUMULATION_STEPS batches,
+    # optionally with the learning rate scaled linearly and a linear warm-up
+    ACCUMULATION_STEPS = params.get('RNN_ACCUMULATION_STEPS', 1)
+    LR = 1e-3 * ACCUMULATION_STEPS if params.get('RNN_LR_SCALING', False) else 1e-3
+    WARMUP_STEPS = params.get('RNN_WARMUP_STEPS', 0)
+
+    optimizer = get_optimizer(model, lr=LR)
+    scheduler = WarmupLR(optimizer, LR, WARMUP_STEPS) if WARMUP_STEPS else None
     criterion = nn.BCEWithLogitsLoss()
     model = model.to(device)
     criterion = criterion.to(device)
 
     if training_mode:
-        best_valid_loss = float('inf')
-        for epoch in range(N_EPOCHS):
-            start_time = time.time()
-            model, train_loss, train_acc = train_epoch(model, train_iterator, optimizer, criterion, device)
-            valid_loss, valid_acc = evaluate(model, val_iterator, criterion)
-            end_time = time.time()
-
-            epoch_mins, epoch_secs = epoch_time(start_time, end_time)
-
-            if valid_loss < best_valid_loss:
-                best_valid_loss = valid_loss
-                torch.save(model.state_dict(), f"{model_name}.pt")
-
-            print(f'Epoch: {epoch + 1:02} | Epoch Time: {epoch_mins}m {epoch_secs}s')
-            print(f'\tTrain Loss: {train_loss:.3f} | Train Acc: {train_acc * 100:.2f}%')
-            print(f'\t Val. Loss: {valid_loss:.3f} |  Val. Acc: {valid_acc * 100:.2f}%')
+        save_vocabs(TEXT, LABEL, model_name)
+        model = fit(model, train_iterator, val_iterator, optimizer, criterion, device,
+                    N_EPOCHS, model_name,
+                    accumulation_steps=ACCUMULATION_STEPS, scheduler=scheduler)
 
     # TODO DO TESTS AND PLOT RESULT
     # Evaluate model performance
@@ -350,4 +582,134 @@ def analyse_sentiments(params=None,
     sentence = "STOKED for the show tomorrow night! 2 great shows combined."
     value = evaluate_sentences(model, sentence, TEXT, device)
     print(f"'{sentence}' sentiment is {value}")
+
+    if params.get('DISTILL_BAG', False) and MODEL_TYPE == 'rnn':
+        bag_model = build_model(dict(params, MODEL_TYPE='bag'), INPUT_DIM, EMBEDDING_DIM, pad_idx,
+                                sparse=SPARSE_EMBEDDINGS and not FREEZE_EMDEDDINGS)
+        # start from the embedding of the trained rnn, a frozen one is shared as is,
+        # trained hash buckets are copied so that distillation does not change the teacher
+        if FREEZE_EMDEDDINGS and not HASH_BUCKETS:
+            bag_model.embedding = model.embedding
+        else:
+            bag_model.embedding.load_state_dict(model.embedding.state_dict())
+            bag_model.embedding.weight.requires_grad = not FREEZE_EMDEDDINGS
+        bag_model = bag_model.to(device)
+        bag_name = f"{model_name}_bag"
+        if training_mode:
+            save_vocabs(TEXT, LABEL, bag_name)
+            bag_model = fit(bag_model, train_iterator, val_iterator, get_optimizer(bag_model, lr=1e-3),
+                            criterion, device, N_EPOCHS, bag_name,
+                            teacher=model, distill_alpha=params.get('DISTILL_ALPHA', 0.5))
+        bag_model.load_state_dict(torch.load(f"{bag_name}.pt"))
+
+        bag_loss, bag_acc = evaluate(bag_model, test_iterator, criterion)
+        rnn_speed = measure_throughput(model, test_iterator)
+        bag_speed = measure_throughput(bag_model, test_iterator)
+        print(f'Bag Test Acc: {bag_acc * 100:.2f}% ({(bag_acc - test_acc) * 100:+.2f}%) | '
+              f'{bag_speed:.0f} vs {rnn_speed:.0f} tweets/s ({bag_speed / rnn_speed:.1f}x)')
+
+        threshold = params.get('CASCADE_THRESHOLD', None)
+        if threshold is not None:
+            cascade_acc, escalated, cascade_speed = evaluate_cascade(bag_model, model, test_iterator, threshold)
+            print(f'Cascade Test Acc: {cascade_acc * 100:.2f}% | escalated {escalated * 100:.1f}% | '
+                  f'{cascade_speed:.0f} tweets/s')
     return test_loss, test_acc
+
+
+def update_sentiments(params=None,
+                      model_name='',
+                      new_data='processed_new.csv',
+                      val_data='processed_val.csv'):
+    """
+    Fine-tune a model trained by analyse_sentiments on new tweets only.
+    The saved vocab is extended with the new words and the embedding table
+    grows accordingly, existing indices are kept. The checkpoint is only
+    replaced if the validation loss improves, the previous one is kept as
+    {model_name}_prev.pt.
+    :param params: same params as used for the original training
+    :param model_name:
+    :param new_data: csv file in ../data/ holding only the new processed tweets
+    :param val_data: csv file in ../data/ the updated model has to improve on
+    :return: validation loss and accuracy of the kept model
+    """
+    vector_name = params['pretrained_vectors']
+    min_freq = params['min_freq']
+    FREEZE_EMDEDDINGS = params['RNN_FREEZE_EMDEDDINGS']
+    N_EPOCHS = params['RNN_EPOCHS']
+    BATCH_SIZE = params['RNN_BATCH_SIZE']
+    MAX_TOKENS = params.get('RNN_MAX_TOKENS', None)
+
+    if params.get('PQ_SUBSPACES', None):
+        raise ValueError("Quantized models can not be updated, retrain from the float32 embeddings")
+
+    TEXT, LABEL = get_fields(max_len=params.get('RNN_MAX_LEN', None))
+    datafields = [('Sentiment', LABEL), ('SentimentText', TEXT)]
+    new_set, val_set = [TabularDataset(path=os.path.join('../data/', fname),
+                                       format='csv',
+                                       skip_header=True,
+                                       fields=datafields) for fname in [new_data, val_data]]
+
+    # the label vocab of the training run, rebuilding it could swap the classes
+    TEXT.vocab = torch.load(f"{model_name}_vocab.pt")
+    LABEL.vocab = torch.load(f"{model_name}_label_vocab.pt")
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    state_dict = torch.load(f"{model_name}.pt", map_location=device)
+    model = build_model(params,
+                        vocab_size=len(TEXT.vocab),
+                        embedding_dim=state_dict['embedding.weight'].shape[1],
+                        pad_idx=TEXT.vocab.stoi[TEXT.pad_token],
+                        sparse=params.get('RNN_SPARSE_EMBEDDINGS', False) and not FREEZE_EMDEDDINGS)
+    model.load_state_dict(state_dict)
+    criterion = nn.BCEWithLogitsLoss()
+    model = model.to(device)
+    criterion = criterion.to(device)
+
+    new_iterator = torchtext.data.BucketIterator(new_set,
+                                                 batch_size=MAX_TOKENS or BATCH_SIZE,
+                                                 batch_size_fn=TokenBudget() if MAX_TOKENS else None,
+                                                 sort_key=lambda x: len(x.SentimentText),
+                                                 sort_within_batch=False,
+                                                 shuffle=True,
+                                                 device=device)
+    val_iterator = torchtext.data.BucketIterator(val_set,
+                                                 batch_size=MAX_TOKENS or BATCH_SIZE,
+                                                 batch_size_fn=TokenBudget() if MAX_TOKENS else None,
+                                                 sort_key=lambda x: len(x.SentimentText),
+                                                 sort_within_batch=False,
+                                                 train=False,
+                                                 device=device)
+
+    # baseline with the saved vocab, the iterators numericalize with the current TEXT.vocab
+    valid_loss, valid_acc = evaluate(model, val_iterator, criterion)
+    print(f'Saved model | Val. Loss: {valid_loss:.3f} |  Val. Acc: {valid_acc * 100:.2f}%')
+
+    # new words of a hashed vocab already have their bucket rows
+    if not isinstance(TEXT.vocab, HashedVocab):
+        vectors = None
+        if vector_name is not None:
+            # update_embeddings has added the new words to these vectors
+            vectors = load_vectors(fname=vector_name)
+        new_vectors = extend_vocab(TEXT.vocab, new_set, min_freq=min_freq, vectors=vectors,
+                                   only_pretrained=FREEZE_EMDEDDINGS)
+        model.extend_embedding(len(TEXT.vocab), new_vectors)
+    model.embedding.weight.requires_grad = not FREEZE_EMDEDDINGS
+
+    update_name = f"{model_name}_update"
+    if os.path.exists(f"{update_name}.pt"):
+        os.remove(f"{update_name}.pt")
+    model = fit(model, new_iterator, val_iterator, get_optimizer(model, lr=1e-3), criterion, device,
+                N_EPOCHS, update_name, best_valid_loss=valid_loss)
+
+    if not os.path.exists(f"{update_name}.pt"):
+        print(f"Validation loss did not improve on {valid_loss:.3f}, keeping {model_name}.pt")
+        return valid_loss, valid_acc
+
+    model.load_state_dict(torch.load(f"{update_name}.pt"))
+    valid_loss, valid_acc = evaluate(model, val_iterator, criterion)
+    for suffix in ['', '_vocab', '_label_vocab']:
+        os.replace(f"{model_name}{suffix}.pt", f"{model_name}_prev{suffix}.pt")
+    os.replace(f"{update_name}.pt", f"{model_name}.pt")
+    save_vocabs(TEXT, LABEL, model_name)
+    print(f"Updated {model_name}.pt, the previous model is in {model_name}_prev.pt")
+    return valid_loss, valid_acc
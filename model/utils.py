@@ -3,7 +3,7 @@ import torch
 def get_model_name(param):
     """
     name = vector_name + num_epochs + rnn_number_of_layers + rnn_dropout + GRU/LSTM
-    separated by underscore
+    (+ hash buckets x hashes + pq subspaces if set) separated by underscore
     :param param:
     :return:
     """
@@ -12,7 +12,9 @@ def get_model_name(param):
     else:
         model_name = f"{param['pretrained_vectors'].split('.')[0]}"
 
-    if param['RNN_USE_GRU']:
+    if param.get('MODEL_TYPE', 'rnn') == 'bag':
+        model_name += f"_BAG"
+    elif param['RNN_USE_GRU']:
         model_name += f"_GRU"
     else:
         model_name += f"_LSTM"
@@ -20,6 +22,12 @@ def get_model_name(param):
     model_name += f"_{param['RNN_EPOCHS']}_epochs" \
                   f"_{param['RNN_N_LAYERS']}"
 
+    # runs that differ only in the embedding table must not overwrite each other's checkpoints
+    if param.get('HASH_BUCKETS', 0):
+        model_name += f"_HASH_{param['HASH_BUCKETS']}x{param.get('HASH_NUM_HASHES', 1)}"
+    if param.get('PQ_SUBSPACES', None):
+        model_name += f"_PQ_{param['PQ_SUBSPACES']}"
+
     print(f"model name is {model_name}")
     return model_name
 
@@ -51,3 +59,54 @@ def epoch_time(start_time, end_time):
     elapsed_mins = int(elapsed_time / 60)
     elapsed_secs = int(elapsed_time - (elapsed_mins * 60))
     return elapsed_mins, elapsed_secs
+
+
+class MultipleOptimizer(object):
+    """
+    Steps several optimizers as one, e.g. SparseAdam for the embedding and Adam for the rest
+    """
+
+    def __init__(self, *optimizers):
+        self.optimizers = optimizers
+
+    def zero_grad(self):
+        for optimizer in self.optimizers:
+            optimizer.zero_grad()
+
+    def step(self):
+        for optimizer in self.optimizers:
+            optimizer.step()
+
+    @property
+    def param_groups(self):
+        return [group for optimizer in self.optimizers for group in optimizer.param_groups]
+
+    def state_dict(self):
+        return [optimizer.state_dict() for optimizer in self.optimizers]
+
+    def load_state_dict(self, state_dicts):
+        for optimizer, state_dict in zip(self.optimizers, state_dicts):
+            optimizer.load_state_dict(state_dict)
+
+
+class WarmupLR(object):
+    """
+    Linear learning rate warm-up from base_lr / warmup_steps to base_lr over warmup_steps optimizer steps.
+    Works with MultipleOptimizer, unlike torch.optim.lr_scheduler.
+    """
+
+    def __init__(self, optimizer, base_lr, warmup_steps):
+        self.optimizer = optimizer
+        self.base_lr = base_lr
+        self.warmup_steps = warmup_steps
+        self.n_steps = 0
+        self._set_lr()
+
+    def _set_lr(self):
+        lr = self.base_lr * min(1.0, (self.n_steps + 1) / self.warmup_steps)
+        for group in self.optimizer.param_groups:
+            group['lr'] = lr
+
+    def step(self):
+        self.n_steps += 1
+        self._set_lr()
@@ -1,7 +1,13 @@
 from gensim.test.utils import datapath
+import os
+import sys
+import time
 import pandas as pd
 import gensim.models
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model'))
+from results_store import ResultsStore
+
 class TweetCorpusWithStops(object):
     """An interator that yields sentences (lists of str)."""
             
@@ -30,7 +36,7 @@ def test_with_stops():
     cbows = [True]
     sentences = TweetCorpusWithStops()
     cols = ['model','capital-common-countries', 'capital-world', 'currency', 'city-in-state', 'family', 'gram1-adjective-to-adverb', 'gram2-opposite', 'gram3-comparative', 'gram3-superl', 'participle', 'nationality-adj', 'past-tense', 'plural noun', 'plural verb', 'total-accuracy']
-    results_df = pd.DataFrame(columns=cols)
+    store = ResultsStore()
 
     
     for a in window_size_list:
@@ -41,6 +47,7 @@ def test_with_stops():
                         
                         run_name = "with_stops_cbow_"+str(cbow)+"_window_"+str(a)+"_size_"+str(b)+"_noise_"+str(c)+"_iters_"+str(d)
                         print("Running test for", run_name)
+                        start_time = time.time()
                         if cbow:
                             model = gensim.models.Word2Vec(sentences=sentences, window=a, sample=0.00001, iter=d, min_count=3, size=b, sg=0, negative=c)
                         else:
@@ -61,13 +68,17 @@ def test_with_stops():
                             accs.append(cat_acc)
                         accuracy = correct / total
                         accs.append(accuracy)
-                        res_row = pd.DataFrame([accs],columns=cols)
-                        results_df = results_df.append(res_row)
 
-                        fname = "with_stops_cbow_"+str(cbow)+"_window_"+str(a)+"_size_"+str(b)+"_noise_"+str(c)+"_iters_"+str(d)+"_accuracy_"+str(accuracy)+".kv"
+                        # accuracy is kept in the results store, not in the file name
+                        fname = run_name+".kv"
                         print("Accuracy:", accuracy, "For:", fname)
-                        results_df.to_csv('with_stops_results-full-bad.csv')
                         model.wv.save_word2vec_format('vectors/'+fname)
+                        # full model for embeddings.update_embeddings, keep it next to the .kv file
+                        model.save('vectors/'+run_name+".w2v")
+                        params = {'window': a, 'size': b, 'noise': c, 'iters': d, 'cbow': cbow, 'stops': True}
+                        store.add_run('word2vec', run_name, params, dict(zip(cols[1:], accs[1:])),
+                                      duration=time.time() - start_time,
+                                      artifacts={'vectors': 'vectors/'+fname, 'model': 'vectors/'+run_name+".w2v"})
 '''
 def test_no_stops():
     window_size_list = [15] 
@@ -0,0 +1,172 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from sklearn.decomposition import IncrementalPCA
+
+
+def kv_to_memmap(kv_path, out_prefix, chunk_rows=100000):
+    """
+    Streams a word2vec text format file (.kv) into a float32 .npy matrix and a
+    word list, one line at a time, so the full file is never held in memory.
+    :param kv_path:
+    :param out_prefix: writes out_prefix.npy and out_prefix.words
+    :param chunk_rows: rows parsed before they are flushed to the memmap
+    :return: read-only memmap of the vectors and the list of words
+    """
+    with open(kv_path, encoding='utf-8', errors='replace') as f:
+        n_words, dim = (int(x) for x in f.readline().split())
+        matrix = open_memmap(out_prefix + ".npy", mode='w+', dtype=np.float32, shape=(n_words, dim))
+        with open(out_prefix + ".words", 'w', encoding='utf-8') as words_file:
+            chunk = []
+            row = 0
+            for line in f:
+                parts = line.rstrip().split(' ')
+                # words can not contain spaces in the twitter corpus, but be safe
+                words_file.write(" ".join(parts[:-dim]) + "\n")
+                chunk.append(np.asarray(parts[-dim:], dtype=np.float32))
+                if len(chunk) == chunk_rows:
+                    matrix[row:row + len(chunk)] = chunk
+                    row += len(chunk)
+                    chunk = []
+            if chunk:
+                matrix[row:row + len(chunk)] = chunk
+                row += len(chunk)
+        matrix.flush()
+    del matrix
+    return np.load(out_prefix + ".npy", mmap_mode='r'), load_words(out_prefix)
+
+
+def load_words(prefix):
+    with open(prefix + ".words", encoding='utf-8') as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def chunks(n_rows, chunk_rows):
+    for start in range(0, n_rows, chunk_rows):
+        yield start, min(start + chunk_rows, n_rows)
+
+
+def column_mean(matrix, chunk_rows=100000):
+    total = np.zeros(matrix.shape[1], dtype=np.float64)
+    for start, end in chunks(matrix.shape[0], chunk_rows):
+        total += matrix[start:end].sum(axis=0)
+    return total / matrix.shape[0]
+
+
+def randomized_pca(matrix, n_components=2, n_oversamples=10, n_iter=2, chunk_rows=100000, seed=10):
+    """
+    Randomized SVD of the centered matrix (Halko et al. 2011) where every product
+    with the matrix is computed chunk by chunk. Memory is O(n_words * (n_components + n_oversamples)).
+    :param matrix: (memory-mapped) n_words x dim matrix
+    :param n_components:
+    :param n_oversamples:
+    :param n_iter: power iterations, improve accuracy for slowly decaying spectra
+    :param chunk_rows:
+    :param seed:
+    :return: n_words x n_components coordinates
+    """
+    n_rows, dim = matrix.shape
+    k = min(n_components + n_oversamples, dim)
+    mean = column_mean(matrix, chunk_rows)
+
+    def centered(start, end):
+        return matrix[start:end].astype(np.float64) - mean
+
+    def times(right):
+        out = np.empty((n_rows, right.shape[1]))
+        for start, end in chunks(n_rows, chunk_rows):
+            out[start:end] = centered(start, end) @ right
+        return out
+
+    def transpose_times(left):
+        out = np.zeros((dim, left.shape[1]))
+        for start, end in chunks(n_rows, chunk_rows):
+            out += centered(start, end).T @ left[start:end]
+        return out
+
+    rng = np.random.RandomState(seed)
+    q, _ = np.linalg.qr(times(rng.normal(size=(dim, k))))
+    for _ in range(n_iter):
+        q, _ = np.linalg.qr(transpose_times(q))
+        q, _ = np.linalg.qr(times(q))
+
+    b = transpose_times(q).T
+    u_b, s, _ = np.linalg.svd(b, full_matrices=False)
+    return (q @ u_b[:, :n_components]) * s[:n_components]
+
+
+def incremental_pca(matrix, n_components=2, chunk_rows=100000):
+    """
+    Two passes of sklearn IncrementalPCA: partial_fit over the chunks, then transform.
+    :param matrix:
+    :param n_components:
+    :param chunk_rows: has to be at least n_components
+    :return:
+    """
+    transformer = IncrementalPCA(n_components=n_components)
+    for start, end in chunks(matrix.shape[0], chunk_rows):
+        if end - start >= n_components:
+            transformer.partial_fit(matrix[start:end])
+    coords = np.empty((matrix.shape[0], n_components))
+    for start, end in chunks(matrix.shape[0], chunk_rows):
+        coords[start:end] = transformer.transform(matrix[start:end])
+    return coords
+
+
+def project_embeddings(kv_path, out_prefix=None, n_components=2, method='rsvd', chunk_rows=100000):
+    """
+    Projects every word of a .kv file to 2-D/3-D and writes the coordinates as
+    float16 to out_prefix.<n>d.npy next to out_prefix.words.
+    :param kv_path:
+    :param out_prefix: defaults to kv_path without extension
+    :param n_components: 2 or 3
+    :param method: 'rsvd' for randomized SVD or 'ipca' for incremental PCA
+    :param chunk_rows:
+    :return: path of the coordinate file
+    """
+    if out_prefix is None:
+        out_prefix = os.path.splitext(kv_path)[0]
+
+    start_time = time.time()
+    if os.path.exists(out_prefix + ".npy") and os.path.exists(out_prefix + ".words"):
+        matrix = np.load(out_prefix + ".npy", mmap_mode='r')
+    else:
+        matrix, _ = kv_to_memmap(kv_path, out_prefix, chunk_rows)
+    print(f"Loaded {matrix.shape[0]} x {matrix.shape[1]} matrix in {time.time() - start_time:.1f} s")
+
+    start_time = time.time()
+    if method == 'rsvd':
+        coords = randomized_pca(matrix, n_components, chunk_rows=chunk_rows)
+    elif method == 'ipca':
+        coords = incremental_pca(matrix, n_components, chunk_rows=chunk_rows)
+    else:
+        raise ValueError(f"Unknown projection method {method}")
+    print(f"Projected with {method} in {time.time() - start_time:.1f} s")
+
+    coords_path = f"{out_prefix}.{n_components}d.npy"
+    np.save(coords_path, coords.astype(np.float16))
+    return coords_path
+
+
+def load_projection(prefix, n_components=2):
+    """
+    Words and memory-mapped coordinates written by project_embeddings
+    :param prefix:
+    :param n_components:
+    :return:
+    """
+    return load_words(prefix), np.load(f"{prefix}.{n_components}d.npy", mmap_mode='r')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Project word vectors of a .kv file to 2-D/3-D")
+    parser.add_argument('kv_path')
+    parser.add_argument('--out_prefix', default=None)
+    parser.add_argument('--n_components', type=int, default=2)
+    parser.add_argument('--method', default='rsvd', choices=['rsvd', 'ipca'])
+    parser.add_argument('--chunk_rows', type=int, default=100000)
+    args = parser.parse_args()
+    print(project_embeddings(args.kv_path, args.out_prefix, args.n_components, args.method, args.chunk_rows))